@@ -3,24 +3,54 @@ Unstructured API调用模块
 负责与远程Unstructured API通信,发送文件并获取JSON响应
 """
 
+import asyncio
 import logging
-import time
-from typing import Any, Dict, List, Optional
+import re
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
 import httpx
+import ijson
 from pathlib import Path
+from tenacity import (
+    AsyncRetrying,
+    RetryCallState,
+    Retrying,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from converter import json_loads
+from file_handler import MIME_TYPES
 
 logger = logging.getLogger(__name__)
 
 
 class UnstructuredAPIError(Exception):
     """Unstructured API调用错误"""
-    pass
+    
+    def __init__(self, message: str, status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+# 可重试的HTTP状态码(除5xx外)
+RETRYABLE_STATUS_CODES = frozenset({408, 429})
+
+# 传输层(建立连接失败)的重试次数
+TRANSPORT_RETRIES = 2
+
+# 顶层为JSON数组的响应体开头(跳过前导空白,不复制数据)
+JSON_ARRAY_START = re.compile(rb'\s*\[')
 
 
 class UnstructuredAPIClient:
     """Unstructured API客户端"""
     
-    def __init__(self, api_url: str, timeout: int = 60, max_retries: int = 3, default_strategy: str = "fast"):
+    def __init__(self, api_url: str, timeout: int = 60, max_retries: int = 3, default_strategy: str = "fast",
+                 base_delay: float = 1.0, max_delay: float = 30.0):
         """
         初始化API客户端
         
@@ -29,13 +59,63 @@ class UnstructuredAPIClient:
             timeout: 请求超时时间(秒)
             max_retries: 最大重试次数
             default_strategy: 默认解析策略
+            base_delay: 重试退避的基础等待时间(秒)
+            max_delay: 重试退避的最大等待时间(秒)
         """
         self.api_url = api_url
         self.timeout = timeout
         self.max_retries = max_retries
         self.default_strategy = default_strategy
+        self.base_delay = base_delay
+        self.max_delay = max_delay
         
-        logger.info(f"初始化Unstructured API客户端: {api_url}")
+        # 长连接复用: 同一服务端的多次上传共享连接池,避免每次请求重新握手
+        self._limits = httpx.Limits(
+            max_keepalive_connections=20,
+            max_connections=100,
+            keepalive_expiry=30
+        )
+        # 连接失败由传输层直接重试,5xx/429等应用层错误由tenacity重试
+        self._client = httpx.Client(
+            timeout=timeout,
+            transport=httpx.HTTPTransport(limits=self._limits, retries=TRANSPORT_RETRIES)
+        )
+        # 异步客户端需绑定事件循环,首次异步调用时再创建
+        self._async_client: Optional[httpx.AsyncClient] = None
+        
+        logger.info("初始化Unstructured API客户端: %s", api_url)
+    
+    def __enter__(self) -> "UnstructuredAPIClient":
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+    
+    async def __aenter__(self) -> "UnstructuredAPIClient":
+        return self
+    
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+    
+    def close(self):
+        """关闭同步连接池"""
+        self._client.close()
+    
+    async def aclose(self):
+        """关闭同步和异步连接池"""
+        self.close()
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """获取(必要时创建)共享的异步客户端"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                timeout=self.timeout,
+                transport=httpx.AsyncHTTPTransport(limits=self._limits, retries=TRANSPORT_RETRIES)
+            )
+        return self._async_client
     
     def process_file(self, file_path: str, strategy: Optional[str] = None) -> List[Dict[str, Any]]:
         """
@@ -60,31 +140,73 @@ class UnstructuredAPIClient:
         # 使用指定的strategy或默认strategy
         strategy_to_use = strategy if strategy else self.default_strategy
         
-        logger.info(f"开始处理文件: {file_path_obj.name}, strategy: {strategy_to_use}")
-        
-        # 重试逻辑
-        last_error = None
-        for attempt in range(self.max_retries):
-            try:
-                result = self._send_request(file_path_obj, strategy_to_use)
-                logger.info(f"文件处理成功: {file_path_obj.name}")
-                return result
-            except httpx.HTTPError as e:
-                last_error = e
-                if attempt < self.max_retries - 1:
-                    # 指数退避策略
-                    wait_time = 2 ** attempt
-                    logger.warning(f"请求失败,{wait_time}秒后重试 (尝试 {attempt + 1}/{self.max_retries}): {e}")
-                    time.sleep(wait_time)
-                else:
-                    logger.error(f"请求失败,已达最大重试次数: {e}")
-            except Exception as e:
-                last_error = e
-                logger.error(f"处理文件时发生错误: {e}")
-                break
-        
-        # 所有重试都失败
-        raise UnstructuredAPIError(f"调用Unstructured API失败: {last_error}")
+        logger.debug("开始处理文件: %s, strategy: %s", file_path_obj.name, strategy_to_use)
+        
+        try:
+            result = Retrying(**self._get_retry_options())(self._send_request, file_path_obj, strategy_to_use)
+        except Exception as e:
+            self._log_final_error(e)
+            raise UnstructuredAPIError(f"调用Unstructured API失败: {e}")
+        
+        logger.debug("文件处理成功: %s", file_path_obj.name)
+        return result
+    
+    def _get_retry_options(self) -> Dict[str, Any]:
+        """
+        获取tenacity重试参数
+        
+        Returns:
+            Dict[str, Any]: Retrying/AsyncRetrying的构造参数
+        """
+        return {
+            'stop': stop_after_attempt(max(1, self.max_retries)),
+            'wait': self._get_retry_wait,
+            'retry': retry_if_exception(self._is_retryable),
+            'before_sleep': self._log_retry,
+            'reraise': True,
+        }
+    
+    def _get_retry_wait(self, retry_state: RetryCallState) -> float:
+        """
+        计算重试等待时间
+        
+        优先使用服务端Retry-After响应头(不超过max_delay),
+        否则使用带完全抖动(full jitter)的指数退避
+        """
+        error = retry_state.outcome.exception()
+        if isinstance(error, UnstructuredAPIError) and error.retry_after is not None:
+            return min(error.retry_after, self.max_delay)
+        
+        return wait_random_exponential(multiplier=self.base_delay, max=self.max_delay)(retry_state)
+    
+    def _log_retry(self, retry_state: RetryCallState):
+        """记录重试日志"""
+        logger.warning(
+            "请求失败,%.2f秒后重试 (尝试 %d/%d): %s",
+            retry_state.next_action.sleep, retry_state.attempt_number, self.max_retries,
+            retry_state.outcome.exception()
+        )
+    
+    def _log_final_error(self, error: Exception):
+        """记录最终失败日志"""
+        if self._is_retryable(error):
+            logger.error("请求失败,已达最大重试次数: %s", error)
+        else:
+            logger.error("处理文件时发生错误: %s", error)
+    
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        """
+        判断错误是否可重试
+        
+        连接/超时等传输层错误以及5xx、408、429响应可重试,
+        其余4xx响应和响应解析错误直接失败
+        """
+        if isinstance(error, httpx.TransportError):
+            return True
+        if isinstance(error, UnstructuredAPIError) and error.status_code is not None:
+            return error.status_code >= 500 or error.status_code in RETRYABLE_STATUS_CODES
+        return False
     
     def _send_request(self, file_path: Path, strategy: str) -> List[Dict[str, Any]]:
         """
@@ -112,29 +234,20 @@ class UnstructuredAPIClient:
                 'strategy': strategy
             }
             
-            # 发送请求
-            with httpx.Client(timeout=self.timeout) as client:
-                logger.debug(f"发送请求到: {self.api_url}, strategy: {strategy}")
-                response = client.post(
-                    self.api_url,
-                    files=files,
-                    data=data
-                )
+            # 发送请求(复用连接池)
+            logger.debug("发送请求到: %s, strategy: %s", self.api_url, strategy)
+            response = self._client.post(
+                self.api_url,
+                files=files,
+                data=data
+            )
         
         # 检查响应状态
-        if response.status_code != 200:
-            error_msg = f"API返回错误状态码: {response.status_code}"
-            try:
-                error_detail = response.json()
-                error_msg += f", 详细信息: {error_detail}"
-            except:
-                error_msg += f", 响应内容: {response.text[:200]}"
-            
-            raise UnstructuredAPIError(error_msg)
+        self._check_response_status(response)
         
         # 解析JSON响应
         try:
-            json_data = response.json()
+            json_data = json_loads(response.content)
         except Exception as e:
             raise UnstructuredAPIError(f"解析API响应失败: {e}")
         
@@ -142,10 +255,131 @@ class UnstructuredAPIClient:
         if not isinstance(json_data, list):
             raise UnstructuredAPIError(f"API响应格式不正确,期望列表,实际: {type(json_data)}")
         
-        logger.debug(f"收到 {len(json_data)} 个元素")
+        logger.debug("收到 %d 个元素", len(json_data))
         
         return json_data
     
+    def iter_elements(self, file_path: str, strategy: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """
+        流式处理文件,边接收API响应边逐个产出元素
+        
+        响应体不会整体加载到内存中,峰值内存只与单个元素大小相关。
+        由于元素在产出后无法撤回,该方法不做重试。
+        
+        Args:
+            file_path: 文件路径
+            strategy: 解析策略 (auto, fast, hi_res, ocr_only), 不指定则使用默认策略
+            
+        Yields:
+            Dict[str, Any]: 单个元素对象
+            
+        Raises:
+            UnstructuredAPIError: API调用失败
+            FileNotFoundError: 文件不存在
+        """
+        file_path_obj = Path(file_path)
+        
+        if not file_path_obj.exists():
+            raise FileNotFoundError(f"文件不存在: {file_path}")
+        
+        strategy_to_use = strategy if strategy else self.default_strategy
+        
+        logger.debug("开始流式处理文件: %s, strategy: %s", file_path_obj.name, strategy_to_use)
+        
+        element_count = 0
+        try:
+            with open(file_path_obj, 'rb') as f:
+                files = {
+                    'files': (file_path_obj.name, f, self._get_content_type(file_path_obj))
+                }
+                data = {
+                    'strategy': strategy_to_use
+                }
+                
+                with self._client.stream("POST", self.api_url, files=files, data=data) as response:
+                    if response.status_code != 200:
+                        response.read()
+                        self._check_response_status(response)
+                    
+                    # 增量解析顶层数组中的元素
+                    elements = ijson.sendable_list()
+                    parser = ijson.items_coro(elements, "item", use_float=True)
+                    
+                    top_level_checked = False
+                    for chunk in response.iter_bytes():
+                        # 顶层不是数组时ijson不会产出任何元素,需单独检查,避免静默返回空结果
+                        if not top_level_checked and chunk.strip():
+                            if not JSON_ARRAY_START.match(chunk):
+                                raise UnstructuredAPIError("API响应格式不正确,期望列表")
+                            top_level_checked = True
+                        parser.send(chunk)
+                        element_count += len(elements)
+                        yield from elements
+                        del elements[:]
+                    
+                    parser.close()
+                    element_count += len(elements)
+                    yield from elements
+        except httpx.HTTPError as e:
+            raise UnstructuredAPIError(f"调用Unstructured API失败: {e}")
+        except ijson.JSONError as e:
+            raise UnstructuredAPIError(f"解析API响应失败: {e}")
+        
+        logger.debug("文件流式处理完成: %s, 共 %d 个元素", file_path_obj.name, element_count)
+    
+    def _check_response_status(self, response: httpx.Response):
+        """
+        检查响应状态码
+        
+        Args:
+            response: HTTP响应对象
+            
+        Raises:
+            UnstructuredAPIError: API返回错误响应
+        """
+        if response.status_code == 200:
+            return
+        
+        error_msg = f"API返回错误状态码: {response.status_code}"
+        try:
+            error_detail = response.json()
+            error_msg += f", 详细信息: {error_detail}"
+        except:
+            error_msg += f", 响应内容: {response.text[:200]}"
+        
+        raise UnstructuredAPIError(
+            error_msg,
+            status_code=response.status_code,
+            retry_after=self._parse_retry_after(response.headers.get('Retry-After'))
+        )
+    
+    @staticmethod
+    def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+        """
+        解析Retry-After响应头
+        
+        Args:
+            value: 响应头的值,可以是秒数或HTTP日期
+            
+        Returns:
+            Optional[float]: 等待秒数,无法解析时返回None
+        """
+        if not value:
+            return None
+        
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    
     def _get_content_type(self, file_path: Path) -> str:
         """
         根据文件扩展名获取Content-Type
@@ -156,99 +390,173 @@ class UnstructuredAPIClient:
         Returns:
             str: Content-Type字符串
         """
-        extension = file_path.suffix.lower()
+        return MIME_TYPES.get(file_path.suffix.lower(), 'application/octet-stream')
+    
+    async def process_file_async(self, file_path: str, strategy: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        异步处理文件
         
-        content_types = {
-            '.pdf': 'application/pdf',
-            '.doc': 'application/msword',
-            '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            '.xls': 'application/vnd.ms-excel',
-            '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            '.ppt': 'application/vnd.ms-powerpoint',
-            '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-        }
+        Args:
+            file_path: 文件路径
+            strategy: 解析策略 (auto, fast, hi_res, ocr_only), 不指定则使用默认策略
+            
+        Returns:
+            List[Dict[str, Any]]: 解析后的JSON数据(元素列表)
+            
+        Raises:
+            UnstructuredAPIError: API调用失败
+            FileNotFoundError: 文件不存在
+        """
+        return await self._process_file_async(self._send_request_async, file_path, strategy)
+    
+    async def process_file_raw_async(self, file_path: str, strategy: Optional[str] = None) -> bytes:
+        """
+        异步处理文件,返回未解析的JSON响应体
+        
+        适合在其他进程中解析和转换的场景:传递字节串的开销远小于传递解析后的元素列表
         
-        return content_types.get(extension, 'application/octet-stream')
+        Args:
+            file_path: 文件路径
+            strategy: 解析策略 (auto, fast, hi_res, ocr_only), 不指定则使用默认策略
+            
+        Returns:
+            bytes: API响应的JSON文本(已确认顶层为数组)
+            
+        Raises:
+            UnstructuredAPIError: API调用失败
+            FileNotFoundError: 文件不存在
+        """
+        return await self._process_file_async(self._send_request_raw_async, file_path, strategy)
     
-    async def process_file_async(self, file_path: str) -> List[Dict[str, Any]]:
+    async def _process_file_async(self, send: Callable[[Path, str], Awaitable[Any]], file_path: str,
+                                  strategy: Optional[str]) -> Any:
         """
-        异步处理文件(用于未来扩展)
+        带重试地异步调用API
         
         Args:
+            send: 发送单次请求并返回结果的协程函数
             file_path: 文件路径
+            strategy: 解析策略,不指定则使用默认策略
             
         Returns:
-            List[Dict[str, Any]]: 解析后的JSON数据(元素列表)
+            Any: send的返回值
         """
         file_path_obj = Path(file_path)
         
         if not file_path_obj.exists():
             raise FileNotFoundError(f"文件不存在: {file_path}")
         
-        logger.info(f"开始异步处理文件: {file_path_obj.name}")
-        
-        # 重试逻辑
-        last_error = None
-        for attempt in range(self.max_retries):
-            try:
-                result = await self._send_request_async(file_path_obj)
-                logger.info(f"文件处理成功: {file_path_obj.name}")
-                return result
-            except httpx.HTTPError as e:
-                last_error = e
-                if attempt < self.max_retries - 1:
-                    wait_time = 2 ** attempt
-                    logger.warning(f"请求失败,{wait_time}秒后重试 (尝试 {attempt + 1}/{self.max_retries}): {e}")
-                    await asyncio.sleep(wait_time)
-                else:
-                    logger.error(f"请求失败,已达最大重试次数: {e}")
-            except Exception as e:
-                last_error = e
-                logger.error(f"处理文件时发生错误: {e}")
-                break
-        
-        raise UnstructuredAPIError(f"调用Unstructured API失败: {last_error}")
-    
-    async def _send_request_async(self, file_path: Path) -> List[Dict[str, Any]]:
-        """
-        异步发送HTTP请求到API
+        strategy_to_use = strategy if strategy else self.default_strategy
+        
+        logger.debug("开始异步处理文件: %s, strategy: %s", file_path_obj.name, strategy_to_use)
+        
+        try:
+            result = await AsyncRetrying(**self._get_retry_options())(
+                send, file_path_obj, strategy_to_use
+            )
+        except Exception as e:
+            self._log_final_error(e)
+            raise UnstructuredAPIError(f"调用Unstructured API失败: {e}")
+        
+        logger.debug("文件处理成功: %s", file_path_obj.name)
+        return result
+    
+    async def _send_request_async(self, file_path: Path, strategy: str) -> List[Dict[str, Any]]:
+        """
+        异步发送HTTP请求到API并解析响应
         
         Args:
             file_path: 文件路径对象
+            strategy: 解析策略
             
         Returns:
             List[Dict[str, Any]]: API响应的JSON数据
         """
-        with open(file_path, 'rb') as f:
-            files = {
-                'files': (file_path.name, f, self._get_content_type(file_path))
-            }
-            
-            async with httpx.AsyncClient(timeout=self.timeout) as client:
-                logger.debug(f"发送异步请求到: {self.api_url}")
-                response = await client.post(
-                    self.api_url,
-                    files=files
-                )
-        
-        if response.status_code != 200:
-            error_msg = f"API返回错误状态码: {response.status_code}"
-            try:
-                error_detail = response.json()
-                error_msg += f", 详细信息: {error_detail}"
-            except:
-                error_msg += f", 响应内容: {response.text[:200]}"
-            
-            raise UnstructuredAPIError(error_msg)
+        response = await self._post_file_async(file_path, strategy)
         
         try:
-            json_data = response.json()
+            json_data = json_loads(response.content)
         except Exception as e:
             raise UnstructuredAPIError(f"解析API响应失败: {e}")
         
         if not isinstance(json_data, list):
             raise UnstructuredAPIError(f"API响应格式不正确,期望列表,实际: {type(json_data)}")
         
-        logger.debug(f"收到 {len(json_data)} 个元素")
+        logger.debug("收到 %d 个元素", len(json_data))
         
         return json_data
+    
+    async def _send_request_raw_async(self, file_path: Path, strategy: str) -> bytes:
+        """
+        异步发送HTTP请求到API,返回未解析的响应体
+        
+        Args:
+            file_path: 文件路径对象
+            strategy: 解析策略
+            
+        Returns:
+            bytes: API响应的JSON文本
+        """
+        response = await self._post_file_async(file_path, strategy)
+        
+        # 只检查顶层是否为数组,完整解析由调用方完成
+        if not JSON_ARRAY_START.match(response.content):
+            raise UnstructuredAPIError("API响应格式不正确,期望列表")
+        
+        return response.content
+    
+    async def _post_file_async(self, file_path: Path, strategy: str) -> httpx.Response:
+        """
+        异步上传文件到API并检查响应状态
+        
+        Args:
+            file_path: 文件路径对象
+            strategy: 解析策略
+            
+        Returns:
+            httpx.Response: 状态码正常的API响应
+        """
+        with open(file_path, 'rb') as f:
+            files = {
+                'files': (file_path.name, f, self._get_content_type(file_path))
+            }
+            
+            data = {
+                'strategy': strategy
+            }
+            
+            logger.debug("发送异步请求到: %s, strategy: %s", self.api_url, strategy)
+            response = await self._get_async_client().post(
+                self.api_url,
+                files=files,
+                data=data
+            )
+        
+        self._check_response_status(response)
+        return response
+    
+    async def process_files_async(self, file_paths: List[str], strategy: Optional[str] = None,
+                                  concurrency: int = 6) -> List[Any]:
+        """
+        并发处理多个文件
+        
+        Args:
+            file_paths: 文件路径列表
+            strategy: 解析策略, 不指定则使用默认策略
+            concurrency: 最大并发请求数
+            
+        Returns:
+            List[Any]: 与file_paths顺序一致的结果列表, 每项为元素列表或处理该文件时抛出的异常
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def _process_one(file_path: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await self.process_file_async(file_path, strategy=strategy)
+        
+        logger.info("开始批量处理 %d 个文件, 并发数: %d", len(file_paths), concurrency)
+        
+        return await asyncio.gather(
+            *[_process_one(file_path) for file_path in file_paths],
+            return_exceptions=True
+        )
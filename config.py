@@ -4,9 +4,31 @@
 """
 
 import os
+import tempfile
 import yaml
-from typing import List, Optional
-from pydantic import BaseModel, Field, validator
+from typing import List, Optional, Tuple
+from pydantic import BaseModel, Field
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # PyYAML未编译libyaml时使用纯Python实现
+    from yaml import SafeLoader as YamlLoader
+
+# 主进程将已加载的配置(JSON)通过该环境变量传给工作进程,工作进程无需再次读取和解析YAML
+PRELOADED_CONFIG_ENV = "JSON2MD_PRELOADED_CONFIG"
+
+
+def default_temp_dir() -> str:
+    """
+    获取默认的临时文件目录
+    
+    系统临时目录通常所有用户可写,目录名中带上用户ID,避免与其他用户的目录冲突
+    
+    Returns:
+        str: 临时文件目录路径
+    """
+    name = f"json2md-{os.getuid()}" if hasattr(os, "getuid") else "json2md"
+    return os.path.join(tempfile.gettempdir(), name)
 
 
 class UnstructuredConfig(BaseModel):
@@ -15,6 +37,8 @@ class UnstructuredConfig(BaseModel):
     timeout: int = Field(default=60, description="请求超时时间(秒)")
     max_retries: int = Field(default=3, description="最大重试次数")
     default_strategy: str = Field(default="fast", description="默认解析策略")
+    retry_base_delay: float = Field(default=1.0, description="重试退避基础等待时间(秒)")
+    retry_max_delay: float = Field(default=30.0, description="重试退避最大等待时间(秒)")
 
 
 class UploadConfig(BaseModel):
@@ -24,13 +48,25 @@ class UploadConfig(BaseModel):
         default=["doc", "docx", "xls", "xlsx", "ppt", "pptx", "pdf"],
         description="允许的文件扩展名"
     )
-    temp_dir: str = Field(default="./temp", description="临时文件目录")
+    temp_dir: str = Field(
+        default_factory=default_temp_dir,
+        description="临时文件目录(默认为系统临时目录下当前用户专属的json2md目录,遵循TMPDIR)"
+    )
+    cleanup_interval: int = Field(default=900, description="旧临时文件的清理间隔(秒)")
 
 
 class ServerConfig(BaseModel):
     """服务器配置"""
     host: str = Field(default="0.0.0.0", description="监听地址")
     port: int = Field(default=8000, description="服务端口")
+    workers: Optional[int] = Field(default=None, description="服务工作进程数(默认为CPU核数*2+1)")
+    convert_workers: Optional[int] = Field(default=None, description="每个工作进程的Markdown转换进程数(默认按工作进程数均分CPU核数)")
+
+
+class CacheConfig(BaseModel):
+    """转换结果缓存配置"""
+    enabled: bool = Field(default=True, description="是否缓存转换结果")
+    max_size: int = Field(default=67108864, description="缓存总大小上限(字节),超出时淘汰最久未使用的结果")
 
 
 class LoggingConfig(BaseModel):
@@ -44,6 +80,7 @@ class AppConfig(BaseModel):
     unstructured: UnstructuredConfig
     upload: UploadConfig
     server: ServerConfig
+    cache: CacheConfig = Field(default_factory=CacheConfig)
     logging: LoggingConfig
 
 
@@ -53,11 +90,18 @@ class ConfigManager:
     def __init__(self, config_path: str = "config.yaml"):
         self.config_path = config_path
         self.config: Optional[AppConfig] = None
+        self._loaded_key: Optional[Tuple[str, int]] = None
         
-    def load_config(self) -> AppConfig:
+    def load_config(self, force_reload: bool = False) -> AppConfig:
         """
         加载配置文件
         
+        配置按文件路径和修改时间缓存,文件未改变时重复调用直接返回已加载的配置;
+        主进程已加载过配置时(见export_config),直接使用其结果
+        
+        Args:
+            force_reload: 是否强制重新加载
+        
         Returns:
             AppConfig: 应用程序配置对象
             
@@ -68,11 +112,24 @@ class ConfigManager:
         # 支持从环境变量指定配置文件路径
         config_path = os.getenv("CONFIG_PATH", self.config_path)
         
-        if not os.path.exists(config_path):
+        try:
+            loaded_key = (config_path, os.stat(config_path).st_mtime_ns)
+        except FileNotFoundError:
             raise FileNotFoundError(f"配置文件不存在: {config_path}")
         
+        if not force_reload:
+            if self.config is not None and loaded_key == self._loaded_key:
+                return self.config
+            
+            preloaded = os.getenv(PRELOADED_CONFIG_ENV)
+            if self.config is None and preloaded:
+                # 目录已由主进程创建
+                self.config = AppConfig.model_validate_json(preloaded)
+                self._loaded_key = loaded_key
+                return self.config
+        
         with open(config_path, 'r', encoding='utf-8') as f:
-            config_data = yaml.safe_load(f)
+            config_data = yaml.load(f, Loader=YamlLoader)
         
         # 支持环境变量覆盖配置
         if os.getenv("UNSTRUCTURED_API_URL"):
@@ -80,18 +137,28 @@ class ConfigManager:
             config_data["unstructured"]["api_url"] = os.getenv("UNSTRUCTURED_API_URL")
         
         # 验证并创建配置对象
-        self.config = AppConfig(**config_data)
+        self.config = AppConfig.model_validate(config_data)
+        self._loaded_key = loaded_key
         
         # 确保必要的目录存在
         self._ensure_directories()
         
         return self.config
     
+    def export_config(self):
+        """
+        将已加载的配置写入环境变量,供之后启动的工作进程直接使用
+        
+        Raises:
+            RuntimeError: 配置尚未加载
+        """
+        os.environ[PRELOADED_CONFIG_ENV] = self.get_config().model_dump_json()
+    
     def _ensure_directories(self):
         """确保必要的目录存在"""
         if self.config:
-            # 创建临时文件目录
-            os.makedirs(self.config.upload.temp_dir, exist_ok=True)
+            # 创建临时文件目录(仅当前用户可访问,权限由FileHandler校验)
+            os.makedirs(self.config.upload.temp_dir, mode=0o700, exist_ok=True)
             
             # 创建日志目录
             log_dir = os.path.dirname(self.config.logging.file)
@@ -3,16 +3,31 @@ JSON到Markdown转换引擎
 负责将Unstructured API返回的JSON数据转换为Markdown格式
 """
 
+import io
 import json
 import logging
-from typing import List, Dict, Any
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, TextIO
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖,未安装时使用标准库json
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# JSON解析函数,优先使用更快的orjson(api_client也使用该函数)
+json_loads = orjson.loads if orjson is not None else json.loads
+
+# 每个线程复用一个转换器实例
+_thread_local = threading.local()
+
 
 class MarkdownConverter:
     """JSON到Markdown转换器"""
     
+    __slots__ = ("_write", "_has_content", "_pending_blank", "last_type", "_dispatch", "_default_handler")
+    
     # 元素类型到Markdown格式的映射
     TYPE_MAPPING = {
         "Title": "h1",
@@ -26,8 +41,38 @@ class MarkdownConverter:
         "PageBreak": "break",
     }
     
+    # 标题级别到格式类型的映射
+    HEADING_TYPES = {1: "h1", 2: "h2"}
+    
+    # 格式类型到处理方法及其参数的映射
+    FORMAT_HANDLERS = {
+        "h1": ("_add_heading", {"level": 1}),
+        "h2": ("_add_heading", {"level": 2}),
+        "text": ("_add_paragraph", {}),
+        "list": ("_add_list_item", {}),
+        "table": ("_add_table", {}),
+        "image": ("_add_image", {}),
+        "footer": ("_add_footer", {}),
+        "break": ("_add_page_break", {}),
+    }
+    
     def __init__(self):
-        self.output_lines = []
+        self.reset()
+        
+        # 预先绑定元素类型到处理方法,每个元素只需一次字典查找
+        self._dispatch = {}
+        for element_type, format_type in self.TYPE_MAPPING.items():
+            method_name, kwargs = self.FORMAT_HANDLERS[format_type]
+            self._dispatch[element_type] = (format_type, getattr(self, method_name), kwargs)
+        
+        # 未知类型按普通段落处理
+        self._default_handler = ("text", self._add_paragraph, {})
+    
+    def reset(self):
+        """重置输出状态,使转换器可被重复使用"""
+        self._write: Optional[Callable[[str], Any]] = None
+        self._has_content = False
+        self._pending_blank = False
         self.last_type = None
     
     def convert(self, json_data: List[Dict[str, Any]]) -> str:
@@ -40,21 +85,68 @@ class MarkdownConverter:
         Returns:
             str: Markdown格式的文本
         """
-        self.output_lines = []
-        self.last_type = None
+        return self.convert_stream(json_data)
+    
+    def convert_stream(self, elements: Iterable[Dict[str, Any]]) -> str:
+        """
+        逐个消费元素并转换为Markdown格式
         
-        logger.info(f"开始转换JSON数据,共 {len(json_data)} 个元素")
+        可直接接收流式解析产出的元素,无需先构建完整的元素列表
         
-        for element in json_data:
-            self._process_element(element)
+        Args:
+            elements: 元素对象的可迭代序列
+            
+        Returns:
+            str: Markdown格式的文本
+        """
+        buf = io.StringIO()
+        element_count = self._convert_elements(elements, buf.write)
         
         # 生成最终的Markdown文本
-        markdown_text = self._format_output()
+        markdown_text = buf.getvalue()
         
-        logger.info(f"转换完成,生成 {len(markdown_text)} 字符的Markdown文本")
+        logger.debug("转换完成,共 %d 个元素,生成 %d 字符的Markdown文本", element_count, len(markdown_text))
         
         return markdown_text
     
+    def convert_to_stream(self, elements: Iterable[Dict[str, Any]], writer: TextIO):
+        """
+        逐个消费元素并将Markdown直接写入输出流,不在内存中保留完整结果
+        
+        Args:
+            elements: 元素对象的可迭代序列
+            writer: 文本输出流(任何具有write(str)方法的对象)
+        """
+        element_count = self._convert_elements(elements, writer.write)
+        
+        logger.debug("转换完成,共 %d 个元素,已写入输出流", element_count)
+    
+    def _convert_elements(self, elements: Iterable[Dict[str, Any]], write: Callable[[str], Any]) -> int:
+        """
+        转换元素并通过write输出
+        
+        Args:
+            elements: 元素对象的可迭代序列
+            write: 输出函数
+            
+        Returns:
+            int: 处理的元素个数
+        """
+        self.reset()
+        self._write = write
+        
+        logger.debug("开始转换JSON数据")
+        
+        element_count = 0
+        try:
+            for element in elements:
+                self._process_element(element)
+                element_count += 1
+        finally:
+            self.reset()
+        
+        return element_count
+    
     def _process_element(self, element: Dict[str, Any]):
         """
         处理单个JSON元素
@@ -68,59 +160,41 @@ class MarkdownConverter:
         if not text:
             return
         
-        # 获取映射的格式类型
-        format_type = self.TYPE_MAPPING.get(element_type, "text")
-        
-        # 根据类型生成相应的Markdown格式
-        if format_type == "h1":
-            self._add_heading(text, 1)
-        elif format_type == "h2":
-            self._add_heading(text, 2)
-        elif format_type == "list":
-            self._add_list_item(text)
-        elif format_type == "table":
-            self._add_table(element)
-        elif format_type == "image":
-            self._add_image(element)
-        elif format_type == "footer":
-            self._add_footer(text)
-        elif format_type == "break":
-            self._add_page_break()
-        else:  # text
-            self._add_paragraph(text)
+        format_type, handler, kwargs = self._dispatch.get(element_type, self._default_handler)
+        handler(text, element, **kwargs)
         
         self.last_type = format_type
     
-    def _add_heading(self, text: str, level: int):
+    def _add_heading(self, text: str, element: Dict[str, Any], level: int):
         """添加标题"""
         # 如果上一个元素不是同类型,添加空行
-        if self.output_lines and self.last_type != f"h{level}":
-            self.output_lines.append("")
+        if self._has_content and self.last_type != self.HEADING_TYPES[level]:
+            self._emit("")
         
         prefix = "#" * level
-        self.output_lines.append(f"{prefix} {text}")
-        self.output_lines.append("")  # 标题后添加空行
+        self._emit(f"{prefix} {text}")
+        self._emit("")  # 标题后添加空行
     
-    def _add_paragraph(self, text: str):
+    def _add_paragraph(self, text: str, element: Dict[str, Any]):
         """添加段落"""
         # 如果上一个元素不是文本,添加空行
-        if self.output_lines and self.last_type not in ["text", None]:
-            self.output_lines.append("")
+        if self._has_content and self.last_type not in ["text", None]:
+            self._emit("")
         
-        self.output_lines.append(text)
-        self.output_lines.append("")  # 段落后添加空行
+        self._emit(text)
+        self._emit("")  # 段落后添加空行
     
-    def _add_list_item(self, text: str):
+    def _add_list_item(self, text: str, element: Dict[str, Any]):
         """添加列表项"""
         # 如果上一个不是列表项,添加空行
-        if self.output_lines and self.last_type != "list":
-            self.output_lines.append("")
+        if self._has_content and self.last_type != "list":
+            self._emit("")
         
-        self.output_lines.append(f"- {text}")
+        self._emit(f"- {text}")
         
         # 注意:不立即添加空行,等下一个非列表项时再添加
     
-    def _add_table(self, element: Dict[str, Any]):
+    def _add_table(self, text: str, element: Dict[str, Any]):
         """
         添加表格
         
@@ -130,17 +204,17 @@ class MarkdownConverter:
         metadata = element.get("metadata", {})
         
         # 如果上一个不是表格,添加空行
-        if self.output_lines and self.last_type != "table":
-            self.output_lines.append("")
+        if self._has_content and self.last_type != "table":
+            self._emit("")
         
         # 简单处理:将表格文本直接输出
         # TODO: 根据实际API响应解析表格结构
-        self.output_lines.append("```")
-        self.output_lines.append(text)
-        self.output_lines.append("```")
-        self.output_lines.append("")
+        self._emit("```")
+        self._emit(text)
+        self._emit("```")
+        self._emit("")
     
-    def _add_image(self, element: Dict[str, Any]):
+    def _add_image(self, text: str, element: Dict[str, Any]):
         """添加图片引用"""
         text = element.get("text") or ""
         metadata = element.get("metadata", {})
@@ -148,60 +222,53 @@ class MarkdownConverter:
         # 尝试从元数据获取图片路径
         image_path = metadata.get("image_path", "")
         
-        if self.output_lines:
-            self.output_lines.append("")
+        if self._has_content:
+            self._emit("")
         
         if image_path:
-            self.output_lines.append(f"![{text}]({image_path})")
+            self._emit(f"![{text}]({image_path})")
         else:
-            self.output_lines.append(f"![图片: {text}]")
+            self._emit(f"![图片: {text}]")
         
-        self.output_lines.append("")
+        self._emit("")
     
-    def _add_footer(self, text: str):
+    def _add_footer(self, text: str, element: Dict[str, Any]):
         """添加页脚"""
-        if self.output_lines:
-            self.output_lines.append("")
+        if self._has_content:
+            self._emit("")
         
-        self.output_lines.append(f"*{text}*")
-        self.output_lines.append("")
+        self._emit(f"*{text}*")
+        self._emit("")
     
-    def _add_page_break(self):
+    def _add_page_break(self, text: str, element: Dict[str, Any]):
         """添加分页符"""
-        if self.output_lines:
-            self.output_lines.append("")
+        if self._has_content:
+            self._emit("")
         
-        self.output_lines.append("---")
-        self.output_lines.append("")
+        self._emit("---")
+        self._emit("")
     
-    def _format_output(self) -> str:
-        """
-        格式化输出,清理多余的空行
-        
-        Returns:
-            str: 格式化后的Markdown文本
+    def _emit(self, line: str):
         """
-        # 移除开头和结尾的空行
-        while self.output_lines and not self.output_lines[0]:
-            self.output_lines.pop(0)
+        写入一行输出
         
-        while self.output_lines and not self.output_lines[-1]:
-            self.output_lines.pop()
+        空行不立即写入,而是在下一个非空行之前补写,
+        从而在写入时合并连续空行并去除开头和结尾的空行
         
-        # 合并连续的多个空行为一个
-        formatted_lines = []
-        prev_empty = False
+        Args:
+            line: 单行文本,空字符串表示空行
+        """
+        if not line.strip():
+            if self._has_content:
+                self._pending_blank = True
+            return
         
-        for line in self.output_lines:
-            is_empty = not line.strip()
-            
-            if is_empty and prev_empty:
-                continue  # 跳过连续的空行
-            
-            formatted_lines.append(line)
-            prev_empty = is_empty
+        if self._has_content:
+            self._write("\n\n" if self._pending_blank else "\n")
         
-        return "\n".join(formatted_lines)
+        self._write(line)
+        self._has_content = True
+        self._pending_blank = False
 
 
 def convert_json_to_markdown(json_data: Any) -> str:
@@ -209,7 +276,7 @@ def convert_json_to_markdown(json_data: Any) -> str:
     将JSON数据转换为Markdown格式的便捷函数
     
     Args:
-        json_data: JSON数据,可以是字符串、列表或字典
+        json_data: JSON数据,可以是字符串、字节串(如API原始响应体)、列表或字典
         
     Returns:
         str: Markdown格式的文本
@@ -217,10 +284,10 @@ def convert_json_to_markdown(json_data: Any) -> str:
     Raises:
         ValueError: JSON数据格式不正确
     """
-    # 如果是字符串,先解析为JSON
-    if isinstance(json_data, str):
+    # 如果是字符串或字节串,先解析为JSON
+    if isinstance(json_data, (str, bytes, bytearray)):
         try:
-            json_data = json.loads(json_data)
+            json_data = json_loads(json_data)
         except json.JSONDecodeError as e:
             raise ValueError(f"JSON解析失败: {e}")
     
@@ -228,5 +295,12 @@ def convert_json_to_markdown(json_data: Any) -> str:
     if not isinstance(json_data, list):
         raise ValueError("JSON数据必须是元素列表格式")
     
-    converter = MarkdownConverter()
-    return converter.convert(json_data)
+    return _get_thread_converter().convert(json_data)
+
+
+def _get_thread_converter() -> MarkdownConverter:
+    """获取当前线程复用的转换器实例"""
+    converter = getattr(_thread_local, "converter", None)
+    if converter is None:
+        converter = _thread_local.converter = MarkdownConverter()
+    return converter
@@ -3,16 +3,65 @@
 负责文件上传验证、临时文件管理和安全检查
 """
 
+import asyncio
+import hashlib
 import os
+import re
+import stat
+import threading
 import uuid
 import logging
 import mimetypes
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, BinaryIO, FrozenSet, Iterator, Optional, Set, Tuple, Union
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# 每个线程复用一块分块复制缓冲区
+_thread_local = threading.local()
+
+# 文件名中不安全的字符(\w与str.isalnum()一致,保留中文等Unicode字母数字)
+UNSAFE_FILENAME_CHARS = re.compile(r'[^\w\- ]')
+
+# MIME类型映射
+MIME_TYPES = {
+    '.pdf': 'application/pdf',
+    '.doc': 'application/msword',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xls': 'application/vnd.ms-excel',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.ppt': 'application/vnd.ms-powerpoint',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+# 在导入时一次性初始化mimetypes注册表并注册Office类型,
+# 避免首个请求触发延迟初始化(加锁并读取系统mime文件)
+mimetypes.init()
+for _ext, _mime_type in MIME_TYPES.items():
+    mimetypes.add_type(_mime_type, _ext)
+
+
+def _private_opener(path: str, flags: int) -> int:
+    """以仅当前用户可读写的权限(0600)创建文件,供open()的opener参数使用"""
+    return os.open(path, flags, 0o600)
+
+
+@lru_cache(maxsize=8)
+def _normalize_extensions(extensions: Tuple[str, ...]) -> Tuple[Tuple[str, ...], FrozenSet[str], str]:
+    """
+    规范化允许的扩展名列表(结果按输入缓存,相同配置只计算一次)
+    
+    Args:
+        extensions: 原始扩展名元组
+        
+    Returns:
+        Tuple[Tuple[str, ...], FrozenSet[str], str]: (规范化后的扩展名, 扩展名集合, 错误提示文本)
+    """
+    normalized = tuple(ext.lower().strip('.') for ext in extensions)
+    return normalized, frozenset(normalized), ', '.join('.' + ext for ext in normalized)
+
 
 class FileValidationError(Exception):
     """文件验证错误"""
@@ -22,18 +71,22 @@ class FileValidationError(Exception):
 class FileHandler:
     """文件处理器"""
     
-    # MIME类型映射
-    MIME_TYPES = {
-        '.pdf': 'application/pdf',
-        '.doc': 'application/msword',
-        '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-        '.xls': 'application/vnd.ms-excel',
-        '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        '.ppt': 'application/vnd.ms-powerpoint',
-        '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    # 流式读写的块大小(1MB)
+    CHUNK_SIZE = 1 << 20
+    
+    # 本进程中已确保存在的临时目录
+    _ensured_dirs: Set[Path] = set()
+    
+    # MIME类型映射(模块级常量的别名,保持原有访问方式)
+    MIME_TYPES = MIME_TYPES
+    
+    # 启用OCR时使用的strategy(仅PDF支持OCR,其他类型始终使用fast)
+    OCR_STRATEGIES = {
+        'pdf': 'hi_res',
     }
     
-    def __init__(self, temp_dir: str, allowed_extensions: list, max_size: int):
+    def __init__(self, temp_dir: str, allowed_extensions: list, max_size: int,
+                 cache_enabled: bool = True, cache_max_size: int = 64 << 20):
         """
         初始化文件处理器
         
@@ -41,15 +94,74 @@ class FileHandler:
             temp_dir: 临时文件目录
             allowed_extensions: 允许的文件扩展名列表
             max_size: 最大文件大小(字节)
+            cache_enabled: 是否缓存转换结果
+            cache_max_size: 转换结果缓存总大小上限(字节)
         """
         self.temp_dir = Path(temp_dir)
-        self.allowed_extensions = [ext.lower().strip('.') for ext in allowed_extensions]
         self.max_size = max_size
+        self.cache_enabled = cache_enabled
+        self.cache_max_size = cache_max_size
+        
+        # 预计算扩展名集合和错误提示,避免每次验证重复构建
+        normalized, self._allowed_ext_set, self._allowed_ext_hint = _normalize_extensions(tuple(allowed_extensions))
+        self.allowed_extensions = list(normalized)
+        
+        # 转换结果缓存目录(按文件内容摘要命名)
+        self.cache_dir = self.temp_dir / "cache"
         
-        # 确保临时目录存在
-        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        # 最近使用的按日期子目录 (日期字符串, 目录路径),同一天内无需重复mkdir
+        self._cached_date_dir: Optional[Tuple[str, Path]] = None
         
-        logger.info(f"文件处理器初始化: temp_dir={temp_dir}, max_size={max_size}")
+        # 确保临时目录存在且仅当前用户可访问(同一目录在进程内只检查一次)
+        if self.temp_dir not in FileHandler._ensured_dirs:
+            self.temp_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+            self._check_private_dir(self.temp_dir)
+            FileHandler._ensured_dirs.add(self.temp_dir)
+        
+        logger.info("文件处理器初始化: temp_dir=%s, max_size=%s", temp_dir, max_size)
+    
+    @staticmethod
+    def _check_private_dir(dir_path: Path):
+        """
+        检查目录是否仅当前用户可访问
+        
+        上传文件和转换结果缓存都保存在该目录中,若其他用户可读写,
+        则可能读取上传的文档或预先放入伪造的缓存结果;
+        已有目录属于当前用户但权限过宽时(如早期版本按默认umask创建的755目录),收紧为700
+        
+        Args:
+            dir_path: 目录路径
+            
+        Raises:
+            RuntimeError: 目录是符号链接、非目录或不属于当前用户
+        """
+        if not hasattr(os, "getuid"):
+            return
+        
+        st = os.lstat(dir_path)
+        if stat.S_ISLNK(st.st_mode) or not stat.S_ISDIR(st.st_mode):
+            raise RuntimeError(f"临时目录不能是符号链接或非目录: {dir_path}")
+        if st.st_uid != os.getuid():
+            raise RuntimeError(f"临时目录不属于当前用户: {dir_path}")
+        if st.st_mode & 0o077:
+            logger.warning("临时目录权限过宽(%o),已改为700: %s", stat.S_IMODE(st.st_mode), dir_path)
+            os.chmod(dir_path, 0o700)
+    
+    @staticmethod
+    def _get_extension(filename: str) -> str:
+        """
+        获取小写的文件扩展名(不含点),规则与Path.suffix一致但无需构建Path对象
+        
+        Args:
+            filename: 文件名
+            
+        Returns:
+            str: 扩展名,没有扩展名时返回空字符串
+        """
+        stem, dot, ext = filename.rpartition('.')
+        if not dot or not stem:
+            return ''
+        return ext.lower()
     
     def validate_file(self, filename: str, file_size: int) -> Tuple[bool, Optional[str]]:
         """
@@ -71,63 +183,312 @@ class FileHandler:
             return False, "文件名包含非法字符"
         
         # 验证文件扩展名
-        file_ext = Path(filename).suffix.lower().strip('.')
-        if file_ext not in self.allowed_extensions:
-            return False, f"不支持的文件类型: .{file_ext}, 仅支持: {', '.join(['.' + ext for ext in self.allowed_extensions])}"
+        file_ext = self._get_extension(filename)
+        if file_ext not in self._allowed_ext_set:
+            return False, f"不支持的文件类型: .{file_ext}, 仅支持: {self._allowed_ext_hint}"
         
-        # 验证文件大小
-        if file_size > self.max_size:
+        # 验证文件大小(通过时只需一次比较,错误信息仅在失败时构建)
+        if not 0 < file_size <= self.max_size:
+            if file_size <= 0:
+                return False, "文件大小无效"
             max_mb = self.max_size / (1024 * 1024)
             actual_mb = file_size / (1024 * 1024)
             return False, f"文件大小超过限制: {actual_mb:.2f}MB > {max_mb:.2f}MB"
         
-        if file_size <= 0:
-            return False, "文件大小无效"
-        
         return True, None
     
-    def save_temp_file(self, file_content: bytes, original_filename: str) -> str:
+    def save_temp_file(self, file_stream: Union[BinaryIO, bytes, bytearray, memoryview],
+                       original_filename: str, declared_size: Optional[int] = None) -> Tuple[str, str]:
         """
-        保存临时文件
+        以流式方式保存临时文件,按块写入磁盘,不在内存中缓存整个文件
+        
+        写入的同时计算文件内容的blake2b摘要,用于查找已缓存的转换结果
         
         Args:
-            file_content: 文件内容(字节)
+            file_stream: 可读的二进制文件对象,或已在内存中的字节数据(直接写入,不再复制)
             original_filename: 原始文件名
+            declared_size: 客户端声明的文件大小(字节),未知时为None
             
         Returns:
-            str: 临时文件路径
+            Tuple[str, str]: (临时文件路径, 文件内容摘要)
             
         Raises:
             FileValidationError: 文件验证失败
         """
-        # 验证文件
-        is_valid, error_msg = self.validate_file(original_filename, len(file_content))
+        if isinstance(file_stream, (bytes, bytearray, memoryview)):
+            file_stream = memoryview(file_stream)
+            declared_size = file_stream.nbytes
+        
+        temp_path = self._prepare_temp_path(original_filename, declared_size)
+        
+        # 分块保存文件,写入过程中持续检查大小(声明大小不可信)
+        hasher = hashlib.blake2b(digest_size=16)
+        written = 0
+        try:
+            try:
+                f = open(temp_path, 'xb', opener=_private_opener)
+            except FileNotFoundError:
+                # 日期目录可能已被清理,重新创建
+                temp_path.parent.mkdir(mode=0o700, exist_ok=True)
+                f = open(temp_path, 'xb', opener=_private_opener)
+            
+            with f:
+                if isinstance(file_stream, memoryview):
+                    # 内存中的数据已通过大小验证,整体写入一次
+                    written = file_stream.nbytes
+                    hasher.update(file_stream)
+                    f.write(file_stream)
+                else:
+                    for chunk in self._iter_chunks(file_stream):
+                        written += len(chunk)
+                        if written > self.max_size:
+                            break
+                        hasher.update(chunk)
+                        f.write(chunk)
+        except Exception as e:
+            logger.error("保存临时文件失败: %s", e)
+            self.cleanup_file(str(temp_path))
+            raise
+        
+        return self._finish_temp_file(temp_path, original_filename, written, hasher.hexdigest())
+    
+    def _iter_chunks(self, file_stream: BinaryIO) -> Iterator[Union[bytes, memoryview]]:
+        """
+        分块读取文件对象
+        
+        支持readinto的文件对象直接读入当前线程复用的缓冲区,不为每个分块分配新的bytes对象
+        
+        Args:
+            file_stream: 可读的二进制文件对象
+            
+        Yields:
+            Union[bytes, memoryview]: 分块数据(缓冲区切片仅在下一次迭代前有效)
+        """
+        readinto = getattr(file_stream, 'readinto', None)
+        if readinto is None:
+            while True:
+                chunk = file_stream.read(self.CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk
+        
+        buffer = getattr(_thread_local, 'copy_buffer', None)
+        if buffer is None or len(buffer) != self.CHUNK_SIZE:
+            buffer = _thread_local.copy_buffer = memoryview(bytearray(self.CHUNK_SIZE))
+        
+        while True:
+            size = readinto(buffer)
+            if not size:
+                return
+            yield buffer[:size]
+    
+    async def save_temp_file_stream(self, upload_file: Any, original_filename: str,
+                                    declared_size: Optional[int] = None) -> Tuple[str, str]:
+        """
+        异步保存上传文件,不阻塞事件循环
+        
+        打开、分块写入和关闭临时文件都在同一个工作线程中完成,每次上传只切换一次线程
+        
+        Args:
+            upload_file: 上传文件对象(如UploadFile),其file属性为可读的二进制文件对象
+            original_filename: 原始文件名
+            declared_size: 客户端声明的文件大小(字节),未知时为None
+            
+        Returns:
+            Tuple[str, str]: (临时文件路径, 文件内容摘要)
+            
+        Raises:
+            FileValidationError: 文件验证失败(超过大小限制时在读取过程中立即中止)
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None, self.save_temp_file, upload_file.file, original_filename, declared_size
+        )
+    
+    def _prepare_temp_path(self, original_filename: str, declared_size: Optional[int]) -> Path:
+        """
+        验证文件并生成唯一的临时文件路径
+        
+        Args:
+            original_filename: 原始文件名
+            declared_size: 声明的文件大小(字节),未知时为None
+            
+        Returns:
+            Path: 临时文件路径
+            
+        Raises:
+            FileValidationError: 文件验证失败
+        """
+        # 先根据声明大小验证;大小未知时只校验文件名,实际大小在写入后校验
+        is_valid, error_msg = self.validate_file(
+            original_filename,
+            declared_size if declared_size is not None else self.max_size
+        )
         if not is_valid:
             raise FileValidationError(error_msg)
         
-        # 生成唯一的临时文件名
-        unique_id = uuid.uuid4().hex[:8]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # 生成唯一的临时文件名(多个工作进程共享临时目录,写入时以独占方式创建,不会覆盖其他请求的文件)
+        now = datetime.now()
+        unique_id = uuid.uuid4().hex
+        timestamp = now.strftime("%Y%m%d_%H%M%S")
         file_ext = Path(original_filename).suffix
         temp_filename = f"{timestamp}_{unique_id}{file_ext}"
         
-        # 创建临时子目录(按日期)
-        date_dir = self.temp_dir / datetime.now().strftime("%Y%m%d")
-        date_dir.mkdir(parents=True, exist_ok=True)
+        # 临时子目录(按日期)
+        date_dir = self._get_date_dir(timestamp[:8])
         
-        temp_path = date_dir / temp_filename
+        return date_dir / temp_filename
+    
+    def _finish_temp_file(self, temp_path: Path, original_filename: str, written: int,
+                          digest: str) -> Tuple[str, str]:
+        """
+        按实际写入大小验证临时文件,验证失败时删除
+        
+        Returns:
+            Tuple[str, str]: (临时文件路径, 文件内容摘要)
+            
+        Raises:
+            FileValidationError: 文件验证失败
+        """
+        is_valid, error_msg = self.validate_file(original_filename, written)
+        if not is_valid:
+            self.cleanup_file(str(temp_path))
+            raise FileValidationError(error_msg)
+        
+        logger.debug("临时文件已保存: %s", temp_path)
+        return str(temp_path), digest
+    
+    def _get_date_dir(self, date_str: str) -> Path:
+        """
+        获取按日期命名的临时子目录,仅在日期变化时创建目录
+        
+        Args:
+            date_str: 日期字符串(%Y%m%d)
+            
+        Returns:
+            Path: 日期子目录路径
+        """
+        cached = self._cached_date_dir
+        if cached is not None and cached[0] == date_str:
+            return cached[1]
+        
+        date_dir = self.temp_dir / date_str
+        date_dir.mkdir(mode=0o700, exist_ok=True)
+        self._cached_date_dir = (date_str, date_dir)
+        return date_dir
+    
+    def _get_cache_path(self, digest: str, filename: str, strategy: str) -> Path:
+        """
+        获取转换结果缓存文件路径
+        
+        API请求中带有文件名和按扩展名确定的Content-Type,相同内容以不同扩展名上传时结果可能不同,
+        因此与strategy一样计入缓存键
+        """
+        return self.cache_dir / f"{digest}_{self._get_extension(filename)}_{strategy}.md"
+    
+    def read_cached_markdown(self, digest: str, filename: str, strategy: str) -> Optional[str]:
+        """
+        读取已缓存的转换结果
+        
+        命中时更新缓存文件的修改时间,使常用的结果不会被定期清理或容量淘汰删除
+        
+        Args:
+            digest: 文件内容摘要
+            filename: 原始文件名
+            strategy: 解析策略
+            
+        Returns:
+            Optional[str]: 缓存的Markdown文本,未启用缓存或未命中(包括刚被清理)时返回None
+        """
+        if not self.cache_enabled:
+            return None
+        
+        cache_path = self._get_cache_path(digest, filename, strategy)
+        try:
+            with open(cache_path, 'r', encoding='utf-8', newline='') as f:
+                markdown_content = f.read()
+        except FileNotFoundError:
+            return None
         
-        # 保存文件
         try:
-            with open(temp_path, 'wb') as f:
-                f.write(file_content)
+            os.utime(cache_path)
+        except OSError:
+            pass
+        
+        logger.debug("命中转换结果缓存: %s", cache_path.name)
+        return markdown_content
+    
+    def store_cached_markdown(self, digest: str, filename: str, strategy: str,
+                              markdown_content: str) -> Optional[str]:
+        """
+        缓存转换结果
+        
+        先写入临时文件再原子替换,避免并发请求读到写了一半的缓存;
+        写入后缓存总大小超过上限时淘汰最久未使用的结果
+        
+        Args:
+            digest: 文件内容摘要
+            filename: 原始文件名
+            strategy: 解析策略
+            markdown_content: Markdown文本
             
-            logger.info(f"临时文件已保存: {temp_path}")
-            return str(temp_path)
+        Returns:
+            Optional[str]: 缓存的Markdown文件路径,未启用缓存或结果超过缓存上限时返回None
+        """
+        if not self.cache_enabled:
+            return None
         
-        except Exception as e:
-            logger.error(f"保存临时文件失败: {e}")
+        # 缓存上限按字节计算,中文等字符编码后不止一个字节
+        content_bytes = markdown_content.encode('utf-8')
+        if len(content_bytes) > self.cache_max_size:
+            return None
+        
+        cache_path = self._get_cache_path(digest, filename, strategy)
+        partial_path = cache_path.with_name(f"{cache_path.name}.{uuid.uuid4().hex[:8]}.partial")
+        
+        # 缓存目录为空时可能已被定期清理删除
+        self.cache_dir.mkdir(mode=0o700, exist_ok=True)
+        
+        try:
+            with open(partial_path, 'xb', opener=_private_opener) as f:
+                f.write(content_bytes)
+            os.replace(partial_path, cache_path)
+        except Exception:
+            self.cleanup_file(str(partial_path))
             raise
+        
+        self._evict_cache()
+        
+        return str(cache_path)
+    
+    def _evict_cache(self):
+        """缓存总大小超过上限时,按修改时间从旧到新删除缓存文件,直到不超过上限"""
+        entries = []
+        total_size = 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith('.md'):
+                    continue
+                try:
+                    st = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                total_size += st.st_size
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        
+        if total_size <= self.cache_max_size:
+            return
+        
+        entries.sort()
+        for _, size, path in entries:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+            if total_size <= self.cache_max_size:
+                break
+        
+        logger.debug("转换结果缓存超过上限,已淘汰至 %d 字节", total_size)
     
     def cleanup_file(self, file_path: str):
         """
@@ -140,11 +501,11 @@ class FileHandler:
             path = Path(file_path)
             if path.exists() and path.is_file():
                 path.unlink()
-                logger.info(f"临时文件已清理: {file_path}")
+                logger.debug("临时文件已清理: %s", file_path)
             else:
-                logger.warning(f"文件不存在或不是文件: {file_path}")
+                logger.warning("文件不存在或不是文件: %s", file_path)
         except Exception as e:
-            logger.error(f"清理临时文件失败: {e}")
+            logger.error("清理临时文件失败: %s", e)
     
     def cleanup_old_files(self, days: int = 1):
         """
@@ -155,26 +516,83 @@ class FileHandler:
         """
         try:
             cutoff_time = datetime.now() - timedelta(days=days)
-            cutoff_timestamp = cutoff_time.timestamp()
             
-            deleted_count = 0
+            deleted_count, _ = self._cleanup_dir(str(self.temp_dir), cutoff_time, skip_recent_date_dirs=True)
             
-            for file_path in self.temp_dir.rglob('*'):
-                if file_path.is_file():
-                    # 检查文件修改时间
-                    if file_path.stat().st_mtime < cutoff_timestamp:
-                        file_path.unlink()
-                        deleted_count += 1
-            
-            logger.info(f"清理了 {deleted_count} 个旧临时文件(>{days}天)")
-            
-            # 清理空目录
-            for dir_path in self.temp_dir.rglob('*'):
-                if dir_path.is_dir() and not any(dir_path.iterdir()):
-                    dir_path.rmdir()
+            logger.info("清理了 %d 个旧临时文件(>%s天)", deleted_count, days)
         
         except Exception as e:
-            logger.error(f"清理旧文件失败: {e}")
+            logger.error("清理旧文件失败: %s", e)
+    
+    def _cleanup_dir(self, dir_path: str, cutoff_time: datetime,
+                     skip_recent_date_dirs: bool = False) -> Tuple[int, bool]:
+        """
+        递归清理目录中早于截止时间的文件,并自底向上删除清空的子目录
+        
+        Args:
+            dir_path: 目录路径
+            cutoff_time: 截止时间,修改时间早于该时间的文件会被删除
+            skip_recent_date_dirs: 是否跳过日期不早于截止时间的日期子目录(%Y%m%d),
+                这些目录中的文件都晚于截止时间,无需逐个检查
+            
+        Returns:
+            Tuple[int, bool]: (删除的文件数, 目录是否已清空)
+        """
+        cutoff_timestamp = cutoff_time.timestamp()
+        deleted_count = 0
+        remaining_count = 0
+        
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                # 多个工作进程可能同时清理,已被其他进程删除的条目直接跳过
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if skip_recent_date_dirs and self._is_recent_date_dir(entry.name, cutoff_time):
+                            remaining_count += 1
+                            continue
+                        
+                        sub_deleted, sub_empty = self._cleanup_dir(entry.path, cutoff_time)
+                        deleted_count += sub_deleted
+                        if not (sub_empty and self._remove_empty_dir(entry.path)):
+                            remaining_count += 1
+                    
+                    elif entry.stat(follow_symlinks=False).st_mtime < cutoff_timestamp:
+                        os.unlink(entry.path)
+                        deleted_count += 1
+                    
+                    else:
+                        remaining_count += 1
+                except FileNotFoundError:
+                    continue
+        
+        return deleted_count, remaining_count == 0
+    
+    @staticmethod
+    def _remove_empty_dir(dir_path: str) -> bool:
+        """
+        删除空目录
+        
+        Args:
+            dir_path: 目录路径
+            
+        Returns:
+            bool: 目录是否已不存在(清理期间有新文件写入时返回False)
+        """
+        try:
+            os.rmdir(dir_path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return False
+        return True
+    
+    @staticmethod
+    def _is_recent_date_dir(name: str, cutoff_time: datetime) -> bool:
+        """判断目录名是否为不早于截止时间的日期(%Y%m%d)"""
+        try:
+            return datetime.strptime(name, "%Y%m%d") >= cutoff_time
+        except ValueError:
+            return False
     
     def get_safe_filename(self, original_filename: str, prefix: str = "converted") -> str:
         """
@@ -187,18 +605,9 @@ class FileHandler:
         Returns:
             str: 安全的文件名
         """
-        # 获取不含扩展名的文件名
+        # 获取不含扩展名的文件名,并将不安全的字符替换为下划线
         base_name = Path(original_filename).stem
-        
-        # 移除不安全的字符
-        safe_chars = []
-        for char in base_name:
-            if char.isalnum() or char in ('-', '_', ' '):
-                safe_chars.append(char)
-            else:
-                safe_chars.append('_')
-        
-        safe_base_name = ''.join(safe_chars).strip()
+        safe_base_name = UNSAFE_FILENAME_CHARS.sub('_', base_name).strip()
         
         # 如果文件名为空或过长,使用默认名称
         if not safe_base_name or len(safe_base_name) > 100:
@@ -217,18 +626,10 @@ class FileHandler:
         Returns:
             str: strategy策略 (fast 或 hi_res)
         """
-        file_ext = Path(filename).suffix.lower().strip('.')
-        
-        # PDF根据OCR选项决定
-        if file_ext == 'pdf':
-            return 'hi_res' if enable_ocr else 'fast'
-        
-        # Word、Excel、PowerPoint默认使用fast
-        if file_ext in ['doc', 'docx', 'xls', 'xlsx', 'ppt', 'pptx']:
+        if not enable_ocr:
             return 'fast'
         
-        # 其他类型使用fast
-        return 'fast'
+        return self.OCR_STRATEGIES.get(self._get_extension(filename), 'fast')
     
     def verify_mime_type(self, file_path: str, expected_extension: str) -> bool:
         """
@@ -243,12 +644,12 @@ class FileHandler:
         """
         try:
             # 使用python-magic库进行更准确的MIME类型检测
-            # 这里使用mimetypes作为基础实现
-            guessed_type, _ = mimetypes.guess_type(file_path)
-            expected_type = self.MIME_TYPES.get(expected_extension.lower())
+            # 这里使用mimetypes作为基础实现(注册表已在导入时初始化,直接查表)
+            guessed_type = mimetypes.types_map.get(os.path.splitext(file_path)[1].lower())
+            expected_type = MIME_TYPES.get(expected_extension.lower())
             
             if not expected_type:
-                logger.warning(f"未知的扩展名: {expected_extension}")
+                logger.warning("未知的扩展名: %s", expected_extension)
                 return True  # 对于未知类型,不进行严格验证
             
             # 某些文件类型可能有多个MIME类型,这里做宽松验证
@@ -258,5 +659,5 @@ class FileHandler:
             return True  # 无法确定时不阻止
         
         except Exception as e:
-            logger.warning(f"MIME类型验证失败: {e}")
+            logger.warning("MIME类型验证失败: %s", e)
             return True  # 验证失败时不阻止
@@ -3,59 +3,311 @@ FastAPI Web服务主程序
 提供文件上传转换的HTTP API接口
 """
 
+import asyncio
 import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 from typing import Optional
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request, Form
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.middleware.cors import CORSMiddleware
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from urllib.parse import quote
 import uvicorn
 
 from config import config_manager, AppConfig
 from file_handler import FileHandler, FileValidationError
 from api_client import UnstructuredAPIClient, UnstructuredAPIError
-from converter import convert_json_to_markdown
+from converter import convert_json_to_markdown, orjson
 
+logger = logging.getLogger(__name__)
+
+# JSON响应类,orjson可用时(见converter)使用更快的orjson序列化
+JSONResponseClass = ORJSONResponse if orjson is not None else JSONResponse
 
 # 全局变量
 app_config: Optional[AppConfig] = None
 file_handler: Optional[FileHandler] = None
 api_client: Optional[UnstructuredAPIClient] = None
+convert_pool: Optional[ProcessPoolExecutor] = None
+log_listener: Optional[logging.handlers.QueueListener] = None
+log_queue_handler: Optional[logging.handlers.QueueHandler] = None
+index_page: Optional[bytes] = None
+cleanup_task: Optional[asyncio.Task] = None
+
+# 首页文件路径
+INDEX_PAGE_PATH = "static/index.html"
 
+# 按秒缓存的时间戳字符串: [整秒时间, ISO格式字符串]
+_ts_cache = [0, ""]
 
-def setup_logging(config: AppConfig):
-    """配置日志系统"""
+
+def setup_logging(config: AppConfig) -> logging.handlers.QueueListener:
+    """
+    配置日志系统
+    
+    日志记录只放入队列,由后台线程写入控制台和日志文件,请求处理不必等待I/O;
+    重复调用时先停止上一次启动的监听器并移除其队列处理器
+    
+    Args:
+        config: 应用配置
+        
+    Returns:
+        QueueListener: 已启动的日志监听器,关闭服务时需调用shutdown_logging()以写完剩余日志
+    """
+    global log_listener, log_queue_handler
+    
+    shutdown_logging()
+    
     log_level = getattr(logging, config.logging.level.upper(), logging.INFO)
     
     # 配置日志格式
     log_format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     
-    # 配置根日志记录器
-    logging.basicConfig(
-        level=log_level,
-        format=log_format,
-        handlers=[
-            logging.StreamHandler(sys.stdout),
-            logging.FileHandler(config.logging.file, encoding='utf-8')
-        ]
+    # 日志在放入队列时按该格式完成格式化,输出端直接写出
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(
+        log_queue,
+        logging.StreamHandler(sys.stdout),
+        logging.FileHandler(config.logging.file, encoding='utf-8')
     )
+    log_listener.start()
+    
+    # 配置根日志记录器(不使用basicConfig,根日志记录器已有处理器时它不会生效)
+    log_queue_handler = logging.handlers.QueueHandler(log_queue)
+    log_queue_handler.setFormatter(logging.Formatter(log_format))
+    root_logger = logging.getLogger()
+    root_logger.setLevel(log_level)
+    root_logger.addHandler(log_queue_handler)
     
     # 设置第三方库的日志级别
     logging.getLogger("httpx").setLevel(logging.WARNING)
     logging.getLogger("uvicorn").setLevel(logging.INFO)
+    
+    return log_listener
+
+
+def shutdown_logging():
+    """
+    停止日志监听器
+    
+    先从根日志记录器移除队列处理器,再等待监听器写完队列中剩余的日志并关闭输出端
+    """
+    global log_listener, log_queue_handler
+    
+    if log_queue_handler is not None:
+        logging.getLogger().removeHandler(log_queue_handler)
+        log_queue_handler = None
+    if log_listener is not None:
+        log_listener.stop()
+        for handler in log_listener.handlers:
+            handler.close()
+        log_listener = None
+
+
+def get_worker_count(config: AppConfig) -> int:
+    """
+    获取服务工作进程数
+    
+    Args:
+        config: 应用配置
+        
+    Returns:
+        int: 工作进程数,未配置时为CPU核数*2+1
+    """
+    return config.server.workers or (os.cpu_count() or 1) * 2 + 1
+
+
+def now_iso() -> str:
+    """
+    获取当前时间的ISO格式字符串(精确到秒,同一秒内复用已格式化的结果)
+    
+    Returns:
+        str: ISO格式的当前时间
+    """
+    now = int(time.time())
+    if now != _ts_cache[0]:
+        _ts_cache[:] = [now, datetime.fromtimestamp(now).isoformat()]
+    return _ts_cache[1]
+
+
+async def periodic_cleanup(interval: int):
+    """
+    定期在工作线程中清理旧的临时文件及清空的子目录,直到任务被取消
+    
+    Args:
+        interval: 清理间隔(秒)
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await run_in_threadpool(file_handler.cleanup_old_files, days=1)
+
+
+def load_index_page() -> Optional[bytes]:
+    """
+    读取首页内容
+    
+    Returns:
+        Optional[bytes]: 首页HTML内容,文件不存在或无法读取时为None
+    """
+    try:
+        with open(INDEX_PAGE_PATH, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def build_content_disposition(filename: str) -> str:
+    """
+    构建附件下载的Content-Disposition响应头(与FileResponse的处理方式一致)
+    
+    Args:
+        filename: 下载文件名
+        
+    Returns:
+        str: Content-Disposition响应头的值
+    """
+    quoted_filename = quote(filename)
+    if quoted_filename != filename:
+        return f"attachment; filename*=utf-8''{quoted_filename}"
+    return f'attachment; filename="{filename}"'
+
+
+class AllowAllCORSMiddleware:
+    """
+    允许所有来源、方法和请求头(并允许携带凭据)的CORS中间件
+    
+    配置固定不变,响应头预先构建好,每个请求只需追加,无需逐项匹配来源、方法和请求头
+    """
+    
+    # 普通跨域请求追加的响应头
+    SIMPLE_HEADERS = [
+        (b"access-control-allow-origin", b"*"),
+        (b"access-control-allow-credentials", b"true"),
+    ]
+    
+    # 预检请求的响应头(允许携带凭据时不能使用*,来源在响应时回显)
+    PREFLIGHT_HEADERS = [
+        (b"vary", b"Origin"),
+        (b"access-control-allow-methods", b"DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT"),
+        (b"access-control-max-age", b"600"),
+        (b"access-control-allow-credentials", b"true"),
+    ]
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        origin = None
+        request_method = None
+        request_headers = None
+        has_cookie = False
+        for name, value in scope["headers"]:
+            if name == b"origin":
+                origin = value
+            elif name == b"access-control-request-method":
+                request_method = value
+            elif name == b"access-control-request-headers":
+                request_headers = value
+            elif name == b"cookie":
+                has_cookie = True
+        
+        # 非跨域请求不做处理
+        if origin is None:
+            await self.app(scope, receive, send)
+            return
+        
+        # 预检请求直接应答,不进入路由
+        if scope["method"] == "OPTIONS" and request_method is not None:
+            headers = self.PREFLIGHT_HEADERS + [(b"access-control-allow-origin", origin)]
+            if request_headers is not None:
+                headers.append((b"access-control-allow-headers", request_headers))
+            await send({"type": "http.response.start", "status": 204, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        
+        # 携带Cookie的请求必须回显具体来源,浏览器不接受*
+        if has_cookie:
+            extra_headers = [
+                (b"access-control-allow-origin", origin),
+                (b"access-control-allow-credentials", b"true"),
+                (b"vary", b"Origin"),
+            ]
+        else:
+            extra_headers = self.SIMPLE_HEADERS
+        
+        async def send_with_cors(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + extra_headers
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cors)
+
+
+class UploadSizeLimitMiddleware:
+    """
+    上传请求体大小限制中间件
+    
+    在读取请求体之前根据Content-Length拒绝超过限制的上传(413),
+    未声明长度的请求在接收过程中累计大小,超过限制时立即中止
+    """
+    
+    # 请求体中除文件内容外的multipart边界和表单字段预留的大小(字节)
+    MULTIPART_OVERHEAD = 64 * 1024
+    
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path or file_handler is None:
+            await self.app(scope, receive, send)
+            return
+        
+        max_body_size = file_handler.max_size + self.MULTIPART_OVERHEAD
+        detail = f"文件大小超过限制: 最大 {file_handler.max_size / (1024 * 1024):.2f}MB"
+        
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                if value.isdigit() and int(value) > max_body_size:
+                    response = JSONResponseClass(status_code=413, content={"detail": detail})
+                    await response(scope, receive, send)
+                    return
+                break
+        
+        received = 0
+        
+        async def receive_with_limit():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body_size:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+        
+        await self.app(scope, receive_with_limit, send)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """应用生命周期管理"""
-    global app_config, file_handler, api_client
+    global app_config, file_handler, api_client, convert_pool, index_page, cleanup_task
     
     # 启动时执行
-    logger = logging.getLogger(__name__)
     logger.info("=" * 60)
     logger.info("文件处理转换系统启动中...")
     
@@ -72,7 +324,9 @@ async def lifespan(app: FastAPI):
         file_handler = FileHandler(
             temp_dir=app_config.upload.temp_dir,
             allowed_extensions=app_config.upload.allowed_extensions,
-            max_size=app_config.upload.max_size
+            max_size=app_config.upload.max_size,
+            cache_enabled=app_config.cache.enabled,
+            cache_max_size=app_config.cache.max_size
         )
         logger.info("✓ 文件处理器初始化完成")
         
@@ -81,12 +335,30 @@ async def lifespan(app: FastAPI):
             api_url=app_config.unstructured.api_url,
             timeout=app_config.unstructured.timeout,
             max_retries=app_config.unstructured.max_retries,
-            default_strategy=app_config.unstructured.default_strategy
+            default_strategy=app_config.unstructured.default_strategy,
+            base_delay=app_config.unstructured.retry_base_delay,
+            max_delay=app_config.unstructured.retry_max_delay
         )
         logger.info("✓ API客户端初始化完成")
         
-        # 清理旧的临时文件
+        # 初始化转换进程池(JSON解析和转Markdown是纯CPU计算,放到子进程中执行以免占用服务进程的GIL)
+        # 每个服务工作进程各有一个进程池,未配置时按工作进程数均分CPU核数,避免进程数成倍膨胀
+        # 使用spawn方式创建子进程,避免在多线程进程中fork
+        convert_workers = app_config.server.convert_workers or max(
+            1, (os.cpu_count() or 1) // get_worker_count(app_config)
+        )
+        convert_pool = ProcessPoolExecutor(
+            max_workers=convert_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+        logger.info("✓ 转换进程池初始化完成")
+        
+        # 读取首页内容,之后的请求直接从内存返回
+        index_page = load_index_page()
+        
+        # 清理旧的临时文件,之后在后台定期清理
         file_handler.cleanup_old_files(days=1)
+        cleanup_task = asyncio.create_task(periodic_cleanup(app_config.upload.cleanup_interval))
         
         logger.info("=" * 60)
         logger.info(f"服务已启动: http://{app_config.server.host}:{app_config.server.port}")
@@ -100,7 +372,18 @@ async def lifespan(app: FastAPI):
     
     # 关闭时执行
     logger.info("服务正在关闭...")
+    if cleanup_task is not None:
+        cleanup_task.cancel()
+        try:
+            await cleanup_task
+        except asyncio.CancelledError:
+            pass
+    if api_client is not None:
+        await api_client.aclose()
+    if convert_pool is not None:
+        convert_pool.shutdown(wait=True)
     logger.info("再见!")
+    shutdown_logging()
 
 
 # 创建FastAPI应用
@@ -108,17 +391,15 @@ app = FastAPI(
     title="文件处理转换系统",
     description="将Office文档和PDF文件转换为Markdown格式",
     version="1.0.0",
+    default_response_class=JSONResponseClass,
     lifespan=lifespan
 )
 
-# 添加CORS中间件
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# 添加上传大小限制中间件
+app.add_middleware(UploadSizeLimitMiddleware, path="/api/convert")
+
+# 添加CORS中间件(最后添加的在最外层,拒绝上传的响应也带有CORS响应头)
+app.add_middleware(AllowAllCORSMiddleware)
 
 # 挂载静态文件目录
 try:
@@ -130,17 +411,16 @@ except Exception:
 @app.get("/")
 async def root():
     """根路径,返回欢迎页面"""
-    try:
-        return FileResponse("static/index.html")
-    except Exception:
-        return {
-            "message": "文件处理转换系统",
-            "version": "1.0.0",
-            "endpoints": {
-                "convert": "POST /api/convert - 上传文件并转换为Markdown",
-                "health": "GET /health - 健康检查"
-            }
+    if index_page is not None:
+        return Response(content=index_page, media_type="text/html")
+    return {
+        "message": "文件处理转换系统",
+        "version": "1.0.0",
+        "endpoints": {
+            "convert": "POST /api/convert - 上传文件并转换为Markdown",
+            "health": "GET /health - 健康检查"
         }
+    }
 
 
 @app.get("/health")
@@ -148,14 +428,13 @@ async def health_check():
     """健康检查接口"""
     return {
         "status": "ok",
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": now_iso(),
         "service": "文件处理转换系统"
     }
 
 
 @app.post("/api/convert")
 async def convert_file(
-    request: Request,
     file: UploadFile = File(...),
     enable_ocr: bool = Form(False)
 ):
@@ -167,38 +446,55 @@ async def convert_file(
         enable_ocr: 是否启用OCR(仅PDF有效)
         
     Returns:
-        FileResponse: Markdown文件下载响应
+        Response: Markdown文件下载响应
         
     Raises:
         HTTPException: 处理错误
     """
-    logger = logging.getLogger(__name__)
     temp_file_path = None
     
     try:
-        # 读取文件内容
-        file_content = await file.read()
         original_filename = file.filename or "unknown"
         
-        logger.info(f"收到文件上传请求: {original_filename}, 大小: {len(file_content)} 字节")
+        logger.debug("收到文件上传请求: %s, 大小: %s 字节", original_filename, file.size)
         
-        # 保存临时文件
+        # 流式保存临时文件(分块读取并异步写入,不整体读入内存)
         try:
-            temp_file_path = file_handler.save_temp_file(file_content, original_filename)
+            temp_file_path, content_digest = await file_handler.save_temp_file_stream(
+                file, original_filename, file.size
+            )
         except FileValidationError as e:
-            logger.warning(f"文件验证失败: {e}")
+            logger.warning("文件验证失败: %s", e)
             raise HTTPException(status_code=400, detail=str(e))
         
         # 根据文件类型和OCR选项决定strategy
         strategy = file_handler.get_strategy_for_file(original_filename, enable_ocr)
-        logger.info(f"使用strategy: {strategy}, OCR启用: {enable_ocr}")
+        logger.debug("使用strategy: %s, OCR启用: %s", strategy, enable_ocr)
         
-        # 调用Unstructured API
+        # 生成输出文件名
+        output_filename = file_handler.get_safe_filename(original_filename)
+        
+        # 相同内容的文件已转换过时直接返回缓存结果,无需调用API
+        # 缓存结果先在工作线程中整体读出,读取前被清理时按未命中处理
+        cached_content = await run_in_threadpool(
+            file_handler.read_cached_markdown, content_digest, original_filename, strategy
+        )
+        if cached_content is not None:
+            logger.info("转换完成(缓存): %s -> %s", original_filename, output_filename)
+            return Response(
+                content=cached_content,
+                media_type="text/markdown",
+                headers={"Content-Disposition": build_content_disposition(output_filename)},
+                background=BackgroundTask(file_handler.cleanup_file, temp_file_path)
+            )
+        
+        # 异步调用Unstructured API,等待响应期间不阻塞其他请求
+        # 只取回原始响应体,JSON解析和转换一起在子进程中完成,传给子进程的只是字节串
         try:
-            logger.info(f"调用Unstructured API处理文件: {original_filename}")
-            json_data = api_client.process_file(temp_file_path, strategy=strategy)
+            logger.debug("调用Unstructured API处理文件: %s", original_filename)
+            json_bytes = await api_client.process_file_raw_async(temp_file_path, strategy=strategy)
         except UnstructuredAPIError as e:
-            logger.error(f"Unstructured API调用失败: {e}")
+            logger.error("Unstructured API调用失败: %s", e)
             raise HTTPException(
                 status_code=503,
                 detail=f"Unstructured API服务暂时不可用: {str(e)}"
@@ -206,40 +502,35 @@ async def convert_file(
         
         # 转换为Markdown
         try:
-            logger.info(f"将JSON转换为Markdown: {original_filename}")
-            markdown_content = convert_json_to_markdown(json_data)
+            logger.debug("将JSON转换为Markdown: %s", original_filename)
+            markdown_content = await asyncio.get_running_loop().run_in_executor(
+                convert_pool, convert_json_to_markdown, json_bytes
+            )
         except Exception as e:
-            logger.error(f"JSON转换失败: {e}")
+            logger.error("JSON转换失败: %s", e)
             raise HTTPException(
                 status_code=500,
                 detail=f"文件转换失败: {str(e)}"
             )
         
-        # 生成输出文件名
-        output_filename = file_handler.get_safe_filename(original_filename)
-        
-        # 保存Markdown到临时文件
-        output_path = temp_file_path + ".md"
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(markdown_content)
-        
-        logger.info(f"转换完成: {original_filename} -> {output_filename}")
+        logger.info("转换完成: %s -> %s", original_filename, output_filename)
         
-        # 返回文件下载响应
-        def cleanup():
-            """清理临时文件"""
-            if temp_file_path:
-                file_handler.cleanup_file(temp_file_path)
-            file_handler.cleanup_file(output_path)
-        
-        # 注册后台清理任务
-        request.app.state.cleanup = cleanup
+        def finalize():
+            """响应发送后清理临时文件,并缓存转换结果供相同文件再次上传时直接使用"""
+            file_handler.cleanup_file(temp_file_path)
+            try:
+                file_handler.store_cached_markdown(
+                    content_digest, original_filename, strategy, markdown_content
+                )
+            except Exception as e:
+                logger.warning("缓存转换结果失败: %s", e)
         
-        return FileResponse(
-            path=output_path,
-            filename=output_filename,
+        # 转换结果已在内存中,直接作为响应体返回,无需先写入文件
+        return Response(
+            content=markdown_content,
             media_type="text/markdown",
-            background=None  # 先返回响应,不立即清理
+            headers={"Content-Disposition": build_content_disposition(output_filename)},
+            background=BackgroundTask(finalize)
         )
     
     except HTTPException:
@@ -249,7 +540,7 @@ async def convert_file(
         raise
     
     except Exception as e:
-        logger.error(f"处理请求时发生未知错误: {e}", exc_info=True)
+        logger.error("处理请求时发生未知错误: %s", e, exc_info=True)
         
         # 清理临时文件
         if temp_file_path:
@@ -264,15 +555,14 @@ async def convert_file(
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     """全局异常处理器"""
-    logger = logging.getLogger(__name__)
-    logger.error(f"未处理的异常: {exc}", exc_info=True)
+    logger.error("未处理的异常: %s", exc, exc_info=True)
     
-    return JSONResponse(
+    return JSONResponseClass(
         status_code=500,
         content={
             "error": "InternalServerError",
             "message": "服务器内部错误",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": now_iso()
         }
     )
 
@@ -287,12 +577,19 @@ def main():
         print("请检查config.yaml文件是否存在且配置正确")
         sys.exit(1)
     
+    # 工作进程继承环境变量,直接使用已加载的配置
+    config_manager.export_config()
+    
     # 启动服务
+    # 事件循环和HTTP解析器使用默认的auto,安装了uvicorn[standard]时自动选用uvloop和httptools
+    # 关闭访问日志,请求日志由接口自行记录
     uvicorn.run(
         "main:app",
         host=config.server.host,
         port=config.server.port,
         reload=False,
+        workers=get_worker_count(config),
+        access_log=False,
         log_level=config.logging.level.lower()
     )
 